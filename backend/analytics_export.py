@@ -0,0 +1,240 @@
+"""
+Columnar analytics export for Lacs Verts.
+
+Streams the reports, lakes and users collections out of MongoDB in batches and
+writes them as Parquet datasets partitioned by month and region:
+
+    python analytics_export.py --output exports
+    python analytics_export.py --output exports --incremental
+
+A full export refuses to write into a directory that already holds data.
+Lakes are small and their status changes, so every run rewrites them in full.
+"""
+
+import asyncio
+import json
+import logging
+import shutil
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Union, get_args, get_origin
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import typer
+from pydantic import BaseModel
+
+from server import db, Lake, Report, User
+
+logger = logging.getLogger(__name__)
+
+# Media blobs and credentials never leave the database
+EXCLUDED_FIELDS = {"image_base64", "video_base64", "session_token"}
+
+PYARROW_TYPES = {
+    str: pa.string(),
+    int: pa.int64(),
+    float: pa.float64(),
+    bool: pa.bool_(),
+    datetime: pa.timestamp("ms"),
+}
+
+STATE_FILE = "_export_state.json"
+# created_at is set before the insert, so a document can land after a newer one
+# has been exported; incremental runs re-read this window and skip ids already written
+OVERLAP = timedelta(minutes=5)
+UNKNOWN_REGION = "inconnue"
+
+
+def model_schema(model: type[BaseModel]) -> pa.Schema:
+    fields = [
+        pa.field("month", pa.string(), nullable=False),
+        pa.field("region", pa.string(), nullable=False),
+    ]
+    for name, info in model.model_fields.items():
+        # Lakes already carry a region, which doubles as the partition column
+        if name in EXCLUDED_FIELDS or name == "region":
+            continue
+        annotation = info.annotation
+        if get_origin(annotation) is Union:
+            annotation = next(arg for arg in get_args(annotation) if arg is not type(None))
+        # Older documents may predate a field, so every column is nullable
+        fields.append(pa.field(name, PYARROW_TYPES[annotation]))
+    return pa.schema(fields)
+
+
+class CollectionExport:
+    def __init__(self, name: str, model: type[BaseModel], region_of=None, snapshot: bool = False):
+        self.name = name
+        self.model = model
+        self.schema = model_schema(model)
+        # Maps a document to its region; collections without one get a single partition
+        self.region_of = region_of or (lambda doc: doc.get("region"))
+        # Snapshot collections are rewritten in full on every run instead of appended to
+        self.snapshot = snapshot
+
+    @property
+    def projection(self):
+        projection = {name: 1 for name in self.schema.names if name in self.model.model_fields}
+        projection["_id"] = 0
+        return projection
+
+    def to_row(self, doc: dict) -> dict:
+        row = {name: doc.get(name) for name in self.schema.names}
+        created_at = doc.get("created_at")
+        row["month"] = created_at.strftime("%Y-%m") if created_at else "inconnu"
+        row["region"] = self.region_of(doc) or UNKNOWN_REGION
+        return row
+
+
+def load_state(output_dir: Path) -> dict:
+    state_path = output_dir / STATE_FILE
+    if not state_path.exists():
+        return {}
+    with open(state_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(output_dir: Path, state: dict):
+    with open(output_dir / STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+
+
+def write_batch(export: CollectionExport, rows: list, root_path: Path, run_id: str, batch_number: int):
+    table = pa.Table.from_pylist(rows, schema=export.schema)
+    pq.write_to_dataset(
+        table,
+        root_path=str(root_path),
+        partition_cols=["month", "region"],
+        basename_template=f"part-{run_id}-{batch_number:05d}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+async def export_collection(export: CollectionExport, output_dir: Path, run_id: str,
+                            state: dict, save, batch_size: int = 5000):
+    """
+    Export one collection, updating `state` and calling `save` after every batch written.
+
+    `state` holds the newest `created_at` exported and the ids exported within
+    OVERLAP of it, which are skipped when the window is read again.
+    """
+    await db[export.name].create_index("created_at")
+    last_created_at = datetime.fromisoformat(state["last_created_at"]) if state.get("last_created_at") else None
+    recent_ids = {
+        doc_id: datetime.fromisoformat(created_at)
+        for doc_id, created_at in state.get("recent_ids", {}).items()
+    }
+    query = {"created_at": {"$gt": last_created_at - OVERLAP}} if last_created_at else {}
+    cursor = db[export.name].find(query, export.projection).sort("created_at", 1).batch_size(batch_size)
+
+    rows = []
+    batch_number = 0
+    exported = 0
+
+    def flush():
+        nonlocal last_created_at, recent_ids
+        write_batch(export, [row for row, _ in rows], output_dir / export.name, run_id, batch_number)
+        for row, created_at in rows:
+            if created_at:
+                last_created_at = max(last_created_at or created_at, created_at)
+                recent_ids[row["id"]] = created_at
+        if last_created_at:
+            recent_ids = {doc_id: c for doc_id, c in recent_ids.items() if c > last_created_at - OVERLAP}
+            state["last_created_at"] = last_created_at.isoformat()
+        state["recent_ids"] = {doc_id: c.isoformat() for doc_id, c in recent_ids.items()}
+        # Saved after each batch so an interrupted run resumes where it stopped
+        save()
+
+    async for doc in cursor:
+        if doc.get("id") in recent_ids:
+            continue
+        rows.append((export.to_row(doc), doc.get("created_at")))
+        if len(rows) >= batch_size:
+            flush()
+            exported += len(rows)
+            batch_number += 1
+            rows = []
+    if rows:
+        flush()
+        exported += len(rows)
+
+    logger.info(f"{export.name}: {exported} documents exported")
+
+
+async def export_snapshot(export: CollectionExport, output_dir: Path, run_id: str, batch_size: int = 5000):
+    """Rewrite a whole collection, replacing the previous snapshot once the new one is complete."""
+    staging = output_dir / f".{export.name}-{run_id}"
+    cursor = db[export.name].find({}, export.projection).batch_size(batch_size)
+
+    rows = []
+    batch_number = 0
+    exported = 0
+    async for doc in cursor:
+        rows.append(export.to_row(doc))
+        if len(rows) >= batch_size:
+            write_batch(export, rows, staging, run_id, batch_number)
+            exported += len(rows)
+            batch_number += 1
+            rows = []
+    if rows:
+        write_batch(export, rows, staging, run_id, batch_number)
+        exported += len(rows)
+
+    shutil.rmtree(output_dir / export.name, ignore_errors=True)
+    if exported:
+        staging.rename(output_dir / export.name)
+    logger.info(f"{export.name}: {exported} documents exported")
+
+
+async def run_export(output_dir: Path, incremental: bool = False, batch_size: int = 5000):
+    if not incremental and output_dir.exists() and any(output_dir.iterdir()):
+        # Exporting everything again would duplicate every row already there
+        raise FileExistsError(f"{output_dir} already holds an export; use --incremental or an empty directory")
+    output_dir.mkdir(parents=True, exist_ok=True)
+    state = load_state(output_dir) if incremental else {}
+    run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+
+    # Reports only carry a lake_id, so their region comes from the lake
+    lake_regions = {
+        lake["id"]: lake.get("region")
+        async for lake in db.lakes.find({}, {"_id": 0, "id": 1, "region": 1})
+    }
+    exports = [
+        CollectionExport("lakes", Lake, snapshot=True),
+        CollectionExport("reports", Report, region_of=lambda doc: lake_regions.get(doc.get("lake_id"))),
+        CollectionExport("users", User),
+    ]
+
+    for export in exports:
+        if export.snapshot:
+            await export_snapshot(export, output_dir, run_id, batch_size=batch_size)
+            continue
+        await export_collection(
+            export,
+            output_dir,
+            run_id,
+            state.setdefault(export.name, {}),
+            save=lambda: save_state(output_dir, state),
+            batch_size=batch_size,
+        )
+
+
+def main(
+    output: Path = typer.Option(Path("exports"), help="Destination directory"),
+    incremental: bool = typer.Option(False, help="Only export documents created since the last run"),
+    batch_size: int = typer.Option(5000, help="Documents per cursor batch and Parquet file"),
+):
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    try:
+        asyncio.run(run_export(output, incremental=incremental, batch_size=batch_size))
+    except FileExistsError as error:
+        raise typer.BadParameter(str(error), param_hint="--output")
+
+
+if __name__ == "__main__":
+    typer.run(main)
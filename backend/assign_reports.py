@@ -0,0 +1,64 @@
+"""
+Backfill the water body and lake of reports that carry GPS coordinates:
+
+    python assign_reports.py
+    python assign_reports.py --all  # also re-assign reports already located
+"""
+
+import asyncio
+import logging
+
+import typer
+from pymongo import UpdateOne
+
+from server import db, load_water_bodies, locate_water_body
+
+logger = logging.getLogger(__name__)
+
+
+async def assign_reports(reassign_all: bool = False, batch_size: int = 1000):
+    water_bodies = await asyncio.to_thread(load_water_bodies)
+    if water_bodies is None:
+        return
+
+    lakes_by_water_body = {
+        lake["water_body_id"]: lake["id"]
+        async for lake in db.lakes.find({"water_body_id": {"$ne": None}}, {"_id": 0, "id": 1, "water_body_id": 1})
+    }
+
+    query = {"latitude": {"$ne": None}, "longitude": {"$ne": None}}
+    if not reassign_all:
+        query["water_body_id"] = None  # matches missing fields too
+    cursor = db.reports.find(query, {"_id": 0, "id": 1, "latitude": 1, "longitude": 1}).batch_size(batch_size)
+
+    updates = []
+    assigned = 0
+    async for report in cursor:
+        water_body_id = locate_water_body(water_bodies, report["latitude"], report["longitude"])
+        update = {"water_body_id": water_body_id}
+        if water_body_id in lakes_by_water_body:
+            update["lake_id"] = lakes_by_water_body[water_body_id]
+            assigned += 1
+        updates.append(UpdateOne({"id": report["id"]}, {"$set": update}))
+        if len(updates) >= batch_size:
+            await db.reports.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        await db.reports.bulk_write(updates, ordered=False)
+
+    logger.info(f"{assigned} reports assigned to a lake")
+
+
+def main(
+    all: bool = typer.Option(False, "--all", help="Re-assign reports that already have a water body"),
+    batch_size: int = typer.Option(1000, help="Reports per cursor batch and bulk write"),
+):
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(assign_reports(reassign_all=all, batch_size=batch_size))
+
+
+if __name__ == "__main__":
+    typer.run(main)
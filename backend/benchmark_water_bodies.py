@@ -0,0 +1,46 @@
+"""
+Benchmark point-in-polygon lookups against the national water body dataset:
+
+    python benchmark_water_bodies.py ../lacs_cotedivoire.geojson --points 20000
+"""
+
+import random
+import time
+from pathlib import Path
+
+import typer
+
+from water_bodies import WaterBodyIndex
+
+# Bounding box of Côte d'Ivoire
+MIN_LON, MIN_LAT, MAX_LON, MAX_LAT = -8.6, 4.3, -2.5, 10.8
+
+
+def main(
+    path: Path = typer.Argument(..., help="GeoJSON written by the extraction script"),
+    points: int = typer.Option(20000, help="Number of lookups per run"),
+    max_distance: float = typer.Option(2000, help="Nearest water body search radius in metres"),
+    seed: int = typer.Option(0),
+):
+    start = time.perf_counter()
+    index = WaterBodyIndex.from_geojson(path)
+    print(f"Index: {len(index)} water bodies, {len(index.edges)} edges, built in {time.perf_counter() - start:.2f} s")
+
+    rng = random.Random(seed)
+    # Uniform points are almost always on dry land; points drawn inside the water
+    # body bounding boxes exercise the polygon tests
+    uniform = [(rng.uniform(MIN_LON, MAX_LON), rng.uniform(MIN_LAT, MAX_LAT)) for _ in range(points)]
+    near_water = []
+    for _ in range(points):
+        min_x, min_y, max_x, max_y = index.bounds[rng.randrange(len(index))]
+        near_water.append((rng.uniform(min_x, max_x), rng.uniform(min_y, max_y)))
+
+    for label, sample in (("uniform", uniform), ("near water", near_water)):
+        start = time.perf_counter()
+        found = sum(index.locate(lon, lat, max_distance=max_distance) is not None for lon, lat in sample)
+        elapsed = time.perf_counter() - start
+        print(f"{label:>10}: {len(sample) / elapsed:,.0f} lookups/s, {found} of {len(sample)} matched")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,211 @@
+"""
+Token-bucket rate limiting and request body caps for the Lacs Verts API.
+
+Each rule applies to a method and a path pattern. Requests are counted per
+session token (`X-Session-ID`) and per IP. Many users can share an IP (proxy,
+carrier-grade NAT), so the IP bucket usually gets a looser limit.
+Buckets live in memory by default; `MongoBucketStore` shares them between
+several workers.
+"""
+
+import hashlib
+import heapq
+import json
+import math
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+
+@dataclass
+class RateLimitRule:
+    method: str
+    path: str  # e.g. "/api/reports/lake/{lake_id}"
+    capacity: int  # burst size, per session
+    refill_per_second: float
+    max_body_bytes: Optional[int] = None
+    ip_capacity: Optional[int] = None  # per IP, defaults to the session limit
+    ip_refill_per_second: Optional[float] = None
+
+    def __post_init__(self):
+        pattern = re.sub(r"\{[^/]+\}", "[^/]+", self.path)
+        self._regex = re.compile(f"^{pattern}/?$")
+        if self.ip_capacity is None:
+            self.ip_capacity = self.capacity
+        if self.ip_refill_per_second is None:
+            self.ip_refill_per_second = self.refill_per_second
+
+    def matches(self, method: str, path: str) -> bool:
+        return method == self.method and bool(self._regex.match(path))
+
+
+class InMemoryBucketStore:
+    def __init__(self, max_keys: int = 100000):
+        self.buckets = {}
+        self.max_keys = max_keys
+
+    async def setup(self):
+        pass
+
+    async def take(self, key: str, capacity: int, refill_per_second: float) -> Tuple[bool, float]:
+        """Take one token; return whether it was allowed and the seconds until the next token."""
+        now = time.monotonic()
+        tokens, updated_at, _, _ = self.buckets.get(key, (capacity, now, capacity, refill_per_second))
+        tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        if key not in self.buckets and len(self.buckets) >= self.max_keys:
+            self._evict(now)
+        self.buckets[key] = (tokens, now, capacity, refill_per_second)
+        return allowed, 0.0 if allowed else (1 - tokens) / refill_per_second
+
+    def _evict(self, now: float):
+        # Buckets that have refilled completely carry no state worth keeping. Otherwise
+        # drop the fullest ones, so throttled clients are the last to get a fresh bucket.
+        fill = {
+            key: min(1.0, (tokens + (now - updated_at) * refill_per_second) / capacity)
+            for key, (tokens, updated_at, capacity, refill_per_second) in self.buckets.items()
+        }
+        full = [key for key, ratio in fill.items() if ratio >= 1]
+        for key in full or heapq.nlargest(max(1, self.max_keys // 10), fill, key=fill.get):
+            del self.buckets[key]
+
+
+class MongoBucketStore:
+    """Shares buckets between workers through a MongoDB collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def setup(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, capacity: int, refill_per_second: float) -> Tuple[bool, float]:
+        now = time.time()
+        refilled = {"$min": [
+            capacity,
+            {"$add": [
+                {"$ifNull": ["$tokens", capacity]},
+                {"$multiply": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, refill_per_second]}
+            ]}
+        ]}
+        # Refill and take in a single atomic update
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    "expires_at": datetime.utcnow() + timedelta(seconds=capacity / refill_per_second)
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket["allowed"]:
+            return True, 0.0
+        return False, (1 - bucket["tokens"]) / refill_per_second
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, rules: List[RateLimitRule], store=None, trusted_proxies: int = 0):
+        self.app = app
+        self.rules = rules
+        self.store = store or InMemoryBucketStore()
+        # Number of proxies in front of the app that append to X-Forwarded-For
+        self.trusted_proxies = trusted_proxies
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rule = next((r for r in self.rules if r.matches(scope["method"], scope["path"])), None)
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        buckets = [(f"ip:{self.client_ip(scope, headers)}", rule.ip_capacity, rule.ip_refill_per_second)]
+        if headers.get("x-session-id"):
+            # Hashed so session tokens are not copied into the bucket store
+            session_hash = hashlib.sha256(headers["x-session-id"].encode()).hexdigest()
+            buckets.append((f"session:{session_hash}", rule.capacity, rule.refill_per_second))
+
+        for key, capacity, refill_per_second in buckets:
+            allowed, retry_after = await self.store.take(
+                f"{rule.method}:{rule.path}:{key}", capacity, refill_per_second
+            )
+            if not allowed:
+                await self.reject(send, 429, "Too many requests", {"retry-after": str(math.ceil(retry_after))})
+                return
+
+        if rule.max_body_bytes is not None:
+            content_length = headers.get("content-length")
+            if content_length is not None and content_length.isdigit():
+                if int(content_length) > rule.max_body_bytes:
+                    await self.reject(send, 413, "Request body too large")
+                    return
+            else:
+                # No declared length: read the body ourselves, up to the limit
+                body = await self.read_body(receive, rule.max_body_bytes)
+                if body is None:
+                    await self.reject(send, 413, "Request body too large")
+                    return
+                receive = self.replay(body, receive)
+
+        await self.app(scope, receive, send)
+
+    def client_ip(self, scope, headers) -> str:
+        # Each proxy appends the address it received the request from, so only the
+        # rightmost `trusted_proxies` entries are trustworthy; anything left of them
+        # was sent by the client
+        forwarded_for = [ip.strip() for ip in headers.get("x-forwarded-for", "").split(",") if ip.strip()]
+        if self.trusted_proxies and forwarded_for:
+            return forwarded_for[-min(self.trusted_proxies, len(forwarded_for))]
+        return scope["client"][0] if scope.get("client") else "unknown"
+
+    @staticmethod
+    async def read_body(receive, limit: int) -> Optional[bytes]:
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > limit:
+                return None
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                break
+        return b"".join(chunks)
+
+    @staticmethod
+    def replay(body: bytes, receive):
+        sent = False
+
+        async def replayed():
+            nonlocal sent
+            if sent:
+                # Later messages (disconnect) still come from the client
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return replayed
+
+    @staticmethod
+    async def reject(send, status: int, detail: str, extra_headers: Optional[dict] = None):
+        body = json.dumps({"detail": detail}).encode()
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        headers += [(k.encode(), v.encode()) for k, v in (extra_headers or {}).items()]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
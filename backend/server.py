@@ -1,18 +1,26 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, UploadFile, Header, Form
 from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
 import base64
 import httpx
 import json
+import asyncio
+
+from rate_limit import RateLimitRule, RateLimitMiddleware, InMemoryBucketStore, MongoBucketStore
+from water_bodies import WaterBodyIndex
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -25,9 +33,42 @@ db = client[os.environ['DB_NAME']]
 # Create the main app without a prefix
 app = FastAPI()
 
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request, exc: RequestValidationError):
+    # Same as FastAPI's handler without echoing inputs, which may be NaN and cannot be sent as JSON
+    errors = [{key: value for key, value in error.items() if key != "input"} for error in exc.errors()]
+    return JSONResponse(status_code=422, content={"detail": jsonable_encoder(errors)})
+
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Rate limits: burst capacity, then one request every 1 / refill_per_second seconds.
+# The tight limit is per session; the IP limit is looser because a whole village
+# behind carrier-grade NAT can share one address.
+# Base64 media makes report and awareness bodies large, so they are capped before parsing.
+MAX_MEDIA_BODY_BYTES = 25 * 1024 * 1024
+RATE_LIMIT_RULES = [
+    RateLimitRule("POST", "/api/reports", capacity=5, refill_per_second=1 / 30,
+                  ip_capacity=50, ip_refill_per_second=1 / 2, max_body_bytes=MAX_MEDIA_BODY_BYTES),
+    RateLimitRule("POST", "/api/awareness", capacity=10, refill_per_second=1 / 6,
+                  ip_capacity=50, ip_refill_per_second=1 / 2, max_body_bytes=MAX_MEDIA_BODY_BYTES),
+    RateLimitRule("POST", "/api/auth/profile", capacity=10, refill_per_second=1 / 6,
+                  ip_capacity=100, ip_refill_per_second=1, max_body_bytes=1024),
+    RateLimitRule("GET", "/api/reports/lake/{lake_id}", capacity=30, refill_per_second=1,
+                  ip_capacity=300, ip_refill_per_second=10),
+]
+
+# Buckets are per process unless RATE_LIMIT_BACKEND=mongo shares them between workers
+if os.environ.get('RATE_LIMIT_BACKEND') == 'mongo':
+    rate_limit_store = MongoBucketStore(db.rate_limits)
+else:
+    rate_limit_store = InMemoryBucketStore()
+
+# Water body polygons from scripts_extract_lacs_cotedivoire_Version4.py, loaded at startup
+WATER_BODIES_PATH = Path(os.environ.get('WATER_BODIES_PATH', ROOT_DIR.parent / 'lacs_cotedivoire.geojson'))
+WATER_BODY_MAX_DISTANCE_M = 2000  # how far from the shore a report can still be matched
+water_bodies: Optional[WaterBodyIndex] = None
+
 # Data Models
 class Lake(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -39,6 +80,8 @@ class Lake(BaseModel):
     region: str = ""
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    version: int = 0  # sync version of the last change
+    water_body_id: Optional[str] = None  # OSM id of the polygon the lake lies in
 
 class LakeCreate(BaseModel):
     name: str
@@ -56,14 +99,19 @@ class Report(BaseModel):
     description: str
     image_base64: Optional[str] = None
     video_base64: Optional[str] = None
+    latitude: Optional[float] = Field(None, ge=-90, le=90, allow_inf_nan=False)
+    longitude: Optional[float] = Field(None, ge=-180, le=180, allow_inf_nan=False)
+    water_body_id: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     status: str = "pending"  # "pending", "reviewed", "resolved"
 
 class ReportCreate(BaseModel):
-    lake_id: str
+    lake_id: Optional[str] = None  # resolved from the coordinates when they are given
     description: str
     image_base64: Optional[str] = None
     video_base64: Optional[str] = None
+    latitude: Optional[float] = Field(None, ge=-90, le=90, allow_inf_nan=False)
+    longitude: Optional[float] = Field(None, ge=-180, le=180, allow_inf_nan=False)
 
 class AwarenessPost(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -75,6 +123,7 @@ class AwarenessPost(BaseModel):
     author_name: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_published: bool = True
+    version: int = 0  # sync version of the last change
 
 class AwarenessPostCreate(BaseModel):
     title: str
@@ -91,6 +140,77 @@ class User(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_admin: bool = False
 
+class Tombstone(BaseModel):
+    collection: str  # "lakes", "awareness_posts"
+    id: str
+    version: int
+    deleted_at: datetime = Field(default_factory=datetime.utcnow)
+
+class SyncResponse(BaseModel):
+    version: int
+    lakes: List[Lake] = []
+    awareness_posts: List[AwarenessPost] = []
+    tombstones: List[Tombstone] = []
+
+# Sync helpers
+# A version taken by a writer that crashed before releasing it stops holding back /sync after this
+SYNC_PENDING_TIMEOUT = timedelta(minutes=1)
+
+async def take_sync_version() -> int:
+    # Every write to a synced collection takes the next value of this counter,
+    # so clients only need to remember the highest version they have seen.
+    # The version is recorded as pending in the same update, until the write lands.
+    while True:
+        counter = await db.counters.find_one({"_id": "sync_version"}) or {"value": 0}
+        version = counter["value"] + 1
+        try:
+            result = await db.counters.update_one(
+                {"_id": "sync_version", "value": counter["value"]},
+                {
+                    "$set": {"value": version},
+                    "$push": {"pending": {"version": version, "taken_at": datetime.utcnow()}}
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            continue  # another writer took this version first
+        if result.matched_count or result.upserted_id is not None:
+            return version
+
+@asynccontextmanager
+async def sync_version():
+    # Use as `async with sync_version() as version:` around the write that stores `version`
+    version = await take_sync_version()
+    try:
+        yield version
+    finally:
+        await db.counters.update_one(
+            {"_id": "sync_version"},
+            {"$pull": {"pending": {"version": version}}}
+        )
+
+async def committed_sync_version() -> int:
+    # Highest version below which every write has landed; /sync must not go past it
+    counter = await db.counters.find_one({"_id": "sync_version"})
+    if not counter:
+        return 0
+    cutoff = datetime.utcnow() - SYNC_PENDING_TIMEOUT
+    pending = [p["version"] for p in counter.get("pending", []) if p["taken_at"] > cutoff]
+    return min(pending) - 1 if pending else counter["value"]
+
+# Spatial helpers
+def load_water_bodies() -> Optional[WaterBodyIndex]:
+    if not WATER_BODIES_PATH.exists():
+        logging.getLogger(__name__).warning(f"{WATER_BODIES_PATH} not found, reports will not be located")
+        return None
+    return WaterBodyIndex.from_geojson(WATER_BODIES_PATH)
+
+def locate_water_body(index: Optional[WaterBodyIndex], latitude: float, longitude: float) -> Optional[str]:
+    if index is None:
+        return None
+    located = index.locate(longitude, latitude, max_distance=WATER_BODY_MAX_DISTANCE_M)
+    return index.ids[located[0]] if located else None
+
 # Authentication helper
 async def get_current_user(x_session_id: str = Header(None)):
     if not x_session_id:
@@ -110,6 +230,13 @@ async def get_admin_user(current_user: User = Depends(get_current_user)):
 # Initialize with sample data
 @api_router.on_event("startup")
 async def startup_event():
+    global water_bodies
+    await rate_limit_store.setup()
+    await db.lakes.create_index("water_body_id")
+    await db.lakes.create_index("version")
+    await db.awareness_posts.create_index("version")
+    await db.tombstones.create_index("version")
+
     # Check if lakes collection is empty and add sample data
     lake_count = await db.lakes.count_documents({})
     if lake_count == 0:
@@ -161,6 +288,34 @@ async def startup_event():
         ]
         await db.lakes.insert_many(sample_lakes)
 
+    # Link lakes to the polygon they lie in; None is stored too so the lookup is not repeated
+    water_bodies = await asyncio.to_thread(load_water_bodies)
+    if water_bodies is not None:
+        async for lake in db.lakes.find({"water_body_id": {"$exists": False}}):
+            async with sync_version() as version:
+                await db.lakes.update_one(
+                    {"id": lake["id"]},
+                    {"$set": {
+                        "water_body_id": locate_water_body(water_bodies, lake["latitude"], lake["longitude"]),
+                        "version": version
+                    }}
+                )
+
+    # Documents written before sync existed have no version yet
+    for collection in (db.lakes, db.awareness_posts):
+        if await collection.count_documents({"version": {"$exists": False}}):
+            async with sync_version() as version:
+                await collection.update_many(
+                    {"version": {"$exists": False}},
+                    {"$set": {"version": version}}
+                )
+
+    # Drop versions left pending by writers that died before releasing them
+    await db.counters.update_one(
+        {"_id": "sync_version"},
+        {"$pull": {"pending": {"taken_at": {"$lt": datetime.utcnow() - SYNC_PENDING_TIMEOUT}}}}
+    )
+
 # Authentication routes
 @api_router.post("/auth/profile")
 async def authenticate_user(x_session_id: str = Header(None)):
@@ -222,10 +377,15 @@ async def update_lake_status(lake_id: str, status: str, current_user: User = Dep
     if status not in ["propre", "à surveiller", "pollué"]:
         raise HTTPException(status_code=400, detail="Invalid status")
     
-    result = await db.lakes.update_one(
-        {"id": lake_id},
-        {"$set": {"status": status, "updated_at": datetime.utcnow()}}
-    )
+    async with sync_version() as version:
+        result = await db.lakes.update_one(
+            {"id": lake_id},
+            {"$set": {
+                "status": status,
+                "updated_at": datetime.utcnow(),
+                "version": version
+            }}
+        )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Lake not found")
@@ -236,6 +396,20 @@ async def update_lake_status(lake_id: str, status: str, current_user: User = Dep
 @api_router.post("/reports", response_model=Report)
 async def create_report(report: ReportCreate, current_user: User = Depends(get_current_user)):
     report_dict = report.dict()
+    if (report.latitude is None) != (report.longitude is None):
+        raise HTTPException(status_code=400, detail="Both latitude and longitude are required")
+    
+    # A lake found from the coordinates takes precedence over the one picked by the client
+    if report.latitude is not None:
+        water_body_id = locate_water_body(water_bodies, report.latitude, report.longitude)
+        lake = await db.lakes.find_one({"water_body_id": water_body_id}) if water_body_id else None
+        report_dict["water_body_id"] = water_body_id
+        if lake:
+            report_dict["lake_id"] = lake["id"]
+    
+    if not report_dict["lake_id"]:
+        raise HTTPException(status_code=400, detail="Unable to determine the lake for this report")
+    
     report_obj = Report(
         **report_dict,
         user_id=current_user.id,
@@ -258,12 +432,14 @@ async def get_reports_by_lake(lake_id: str):
 @api_router.post("/awareness", response_model=AwarenessPost)
 async def create_awareness_post(post: AwarenessPostCreate, current_user: User = Depends(get_admin_user)):
     post_dict = post.dict()
-    awareness_obj = AwarenessPost(
-        **post_dict,
-        author_id=current_user.id,
-        author_name=current_user.name
-    )
-    await db.awareness_posts.insert_one(awareness_obj.dict())
+    async with sync_version() as version:
+        awareness_obj = AwarenessPost(
+            **post_dict,
+            author_id=current_user.id,
+            author_name=current_user.name,
+            version=version
+        )
+        await db.awareness_posts.insert_one(awareness_obj.dict())
     return awareness_obj
 
 @api_router.get("/awareness", response_model=List[AwarenessPost])
@@ -273,11 +449,49 @@ async def get_awareness_posts():
 
 @api_router.delete("/awareness/{post_id}")
 async def delete_awareness_post(post_id: str, current_user: User = Depends(get_admin_user)):
-    result = await db.awareness_posts.delete_one({"id": post_id})
+    if not await db.awareness_posts.find_one({"id": post_id}):
+        raise HTTPException(status_code=404, detail="Post not found")
+    
+    # Tombstone first: if the delete then fails, clients drop a post the server
+    # still has, rather than keeping a deleted one forever
+    async with sync_version() as version:
+        tombstone = Tombstone(
+            collection="awareness_posts",
+            id=post_id,
+            version=version
+        )
+        await db.tombstones.insert_one(tombstone.dict())
+        result = await db.awareness_posts.delete_one({"id": post_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Post not found")
     return {"message": "Post deleted successfully"}
 
+# Sync routes
+@api_router.get("/sync", response_model=SyncResponse)
+async def sync(since: int = 0):
+    # Clients keep the returned version and pass it back as `since` next time
+    if since < 0:
+        raise HTTPException(status_code=400, detail="Invalid version")
+    
+    # Read the version first so nothing written during the queries is skipped
+    # on the next sync (at worst it is sent twice). Versions taken by writes that
+    # have not landed yet hold it back, so those writes are picked up next time.
+    version = await committed_sync_version()
+    changed = {"version": {"$gt": since}}
+    
+    lakes = await db.lakes.find(changed).sort("version", 1).to_list(None)
+    posts = await db.awareness_posts.find(
+        {**changed, "is_published": True}
+    ).sort("version", 1).to_list(None)
+    tombstones = await db.tombstones.find(changed).sort("version", 1).to_list(None)
+    
+    return SyncResponse(
+        version=version,
+        lakes=[Lake(**lake) for lake in lakes],
+        awareness_posts=[AwarenessPost(**post) for post in posts],
+        tombstones=[Tombstone(**tombstone) for tombstone in tombstones]
+    )
+
 # Root route
 @api_router.get("/")
 async def root():
@@ -286,6 +500,14 @@ async def root():
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(
+    RateLimitMiddleware,
+    rules=RATE_LIMIT_RULES,
+    store=rate_limit_store,
+    # Proxies in front of the app (the ingress), whose X-Forwarded-For entries are trusted
+    trusted_proxies=int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', '0'))
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
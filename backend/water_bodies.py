@@ -0,0 +1,145 @@
+"""
+Spatial index over the water bodies extracted by
+scripts_extract_lacs_cotedivoire_Version4.py.
+
+Feature bounding boxes are packed into a static R-tree (Sort-Tile-Recursive),
+which narrows a lookup down to a handful of polygons; the point-in-polygon and
+distance tests then run over all edges of those polygons at once with numpy.
+"""
+
+import json
+import math
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+NODE_CAPACITY = 16
+METERS_PER_DEGREE = 111320.0
+
+
+class WaterBodyIndex:
+    def __init__(self, features: List[dict]):
+        self.ids = []
+        self.names = []
+        bounds = []
+        edges = []
+        edge_offsets = [0]
+
+        for i, feature in enumerate(features):
+            rings = feature_rings(feature.get("geometry") or {})
+            if not rings:
+                continue
+            properties = feature.get("properties") or {}
+            self.ids.append(properties.get("osm_id") or f"feature/{i}")
+            self.names.append(properties.get("name", ""))
+
+            points = np.concatenate(rings)
+            bounds.append([*points.min(axis=0), *points.max(axis=0)])
+            feature_edges = np.concatenate([np.hstack([ring[:-1], ring[1:]]) for ring in rings])
+            edges.append(feature_edges)
+            edge_offsets.append(edge_offsets[-1] + len(feature_edges))
+
+        # x1, y1, x2, y2 for every edge; feature k owns edges[edge_offsets[k]:edge_offsets[k + 1]]
+        self.edges = np.concatenate(edges) if edges else np.empty((0, 4))
+        self.edge_offsets = np.array(edge_offsets)
+        self.bounds = np.array(bounds).reshape(-1, 4)
+        self._build_tree()
+
+    @classmethod
+    def from_geojson(cls, path: Path) -> "WaterBodyIndex":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f).get("features", []))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _build_tree(self):
+        # Leaves are the features in STR order: sliced by x centre, then sorted by y within each slice
+        count = len(self.bounds)
+        centres = (self.bounds[:, :2] + self.bounds[:, 2:]) / 2
+        slice_size = NODE_CAPACITY * max(1, math.ceil(math.sqrt(math.ceil(count / NODE_CAPACITY))))
+        by_x = np.argsort(centres[:, 0], kind="stable")
+        order = np.concatenate([
+            by_x[start:start + slice_size][np.argsort(centres[by_x[start:start + slice_size], 1], kind="stable")]
+            for start in range(0, count, slice_size)
+        ]) if count else np.empty(0, dtype=int)
+        self.leaf_order = order
+
+        # levels[0] holds leaf boxes; each level above holds the union of NODE_CAPACITY children
+        self.levels = [self.bounds[order]]
+        while len(self.levels[-1]) > NODE_CAPACITY:
+            children = self.levels[-1]
+            starts = np.arange(0, len(children), NODE_CAPACITY)
+            self.levels.append(np.hstack([
+                np.minimum.reduceat(children[:, :2], starts),
+                np.maximum.reduceat(children[:, 2:], starts),
+            ]))
+
+    def candidates(self, min_x: float, min_y: float, max_x: float, max_y: float) -> np.ndarray:
+        """Return the features whose bounding box intersects the given box."""
+        nodes = np.arange(len(self.levels[-1]))
+        for depth in range(len(self.levels) - 1, -1, -1):
+            boxes = self.levels[depth][nodes]
+            hits = (boxes[:, 0] <= max_x) & (boxes[:, 2] >= min_x) & (boxes[:, 1] <= max_y) & (boxes[:, 3] >= min_y)
+            nodes = nodes[hits]
+            if depth:
+                nodes = (nodes[:, None] * NODE_CAPACITY + np.arange(NODE_CAPACITY)).ravel()
+                nodes = nodes[nodes < len(self.levels[depth - 1])]
+        return self.leaf_order[nodes]
+
+    def contains(self, feature: int, lon: float, lat: float) -> bool:
+        # Even-odd ray casting over every ring, so inner rings punch holes
+        x1, y1, x2, y2 = self.edges[self.edge_offsets[feature]:self.edge_offsets[feature + 1]].T
+        crosses = (y1 > lat) != (y2 > lat)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_at_lat = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+        return bool(np.count_nonzero(crosses & (lon < x_at_lat)) % 2)
+
+    def distance(self, feature: int, lon: float, lat: float) -> float:
+        """Distance in metres from the point to the nearest edge of the feature."""
+        # Equirectangular projection around the point is accurate enough at these scales
+        scale = math.cos(math.radians(lat))
+        x1, y1, x2, y2 = self.edges[self.edge_offsets[feature]:self.edge_offsets[feature + 1]].T
+        ax, ay = (x1 - lon) * scale, y1 - lat
+        bx, by = (x2 - lon) * scale, y2 - lat
+        dx, dy = bx - ax, by - ay
+        length2 = dx * dx + dy * dy
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.clip(np.where(length2 > 0, -(ax * dx + ay * dy) / length2, 0), 0, 1)
+        return float(np.sqrt(np.min((ax + t * dx) ** 2 + (ay + t * dy) ** 2)) * METERS_PER_DEGREE)
+
+    def locate(self, lon: float, lat: float, max_distance: float = 2000) -> Optional[Tuple[int, float]]:
+        """
+        Return (feature, distance in metres) for the water body containing the point,
+        or the nearest one within `max_distance` metres; None if there is none.
+        """
+        if not len(self):
+            return None
+        for feature in self.candidates(lon, lat, lon, lat):
+            if self.contains(feature, lon, lat):
+                return int(feature), 0.0
+
+        delta_lat = max_distance / METERS_PER_DEGREE
+        delta_lon = delta_lat / max(math.cos(math.radians(lat)), 1e-6)
+        nearest = None
+        for feature in self.candidates(lon - delta_lon, lat - delta_lat, lon + delta_lon, lat + delta_lat):
+            distance = self.distance(feature, lon, lat)
+            if distance <= max_distance and (nearest is None or distance < nearest[1]):
+                nearest = (int(feature), distance)
+        return nearest
+
+
+def feature_rings(geometry: dict) -> List[np.ndarray]:
+    if geometry.get("type") == "Polygon":
+        polygons = [geometry.get("coordinates") or []]
+    elif geometry.get("type") == "MultiPolygon":
+        polygons = geometry.get("coordinates") or []
+    else:
+        return []
+    return [
+        np.asarray(ring, dtype=float)[:, :2]
+        for polygon in polygons
+        for ring in polygon
+        if len(ring) >= 4
+    ]
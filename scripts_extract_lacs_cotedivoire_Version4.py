@@ -1,6 +1,7 @@
 import requests
 import json
 import os
+import gzip
 from shutil import copyfile
 
 OVERPASS_API = "https://overpass-api.de/api/interpreter"
@@ -26,6 +27,7 @@ def way_to_geojson_feature(way):
     if coords and coords[0] != coords[-1]:
         coords.append(coords[0])
     props = {
+        "osm_id": f"way/{way.get('id', '')}",
         "name": way.get('tags', {}).get('name', ''),
         "type": "lac" if "lac" in way.get('tags', {}).get('name', '').lower() else 
                 "lagune" if "lagune" in way.get('tags', {}).get('name', '').lower() else
@@ -42,15 +44,92 @@ def way_to_geojson_feature(way):
         }
     }
 
+def assemble_rings(ways):
+    """
+    Relie bout à bout les chemins d'une relation pour former des anneaux fermés.
+    Renvoie les anneaux et le nombre de morceaux qui n'ont pas pu être fermés.
+    """
+    rings = []
+    open_ways = []
+    for coords in ways:
+        if len(coords) >= 4 and coords[0] == coords[-1]:
+            rings.append(coords)
+        elif len(coords) >= 2:
+            open_ways.append(coords)
+
+    unassembled = 0
+    while open_ways:
+        ring = open_ways.pop()
+        while ring[0] != ring[-1]:
+            for i, way in enumerate(open_ways):
+                if way[0] == ring[-1]:
+                    ring = ring + way[1:]
+                elif way[-1] == ring[-1]:
+                    ring = ring + way[-2::-1]
+                elif way[-1] == ring[0]:
+                    ring = way[:-1] + ring
+                elif way[0] == ring[0]:
+                    ring = way[:0:-1] + ring
+                else:
+                    continue
+                del open_ways[i]
+                break
+            else:
+                break
+        if ring[0] == ring[-1] and len(ring) >= 4:
+            rings.append(ring)
+        else:
+            unassembled += 1
+    return rings, unassembled
+
+def point_in_ring(point, ring):
+    x, y = point
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+def inner_in_outer(inner, outer):
+    # Les îles partagent souvent un nœud avec le contour extérieur : on teste un
+    # sommet qui n'est pas sur ce contour, ou à défaut le centre de l'anneau
+    shared = {tuple(pt) for pt in outer}
+    free = [pt for pt in inner[:-1] if tuple(pt) not in shared]
+    if free:
+        return point_in_ring(free[0], outer)
+    centroid = [sum(c) / len(inner[:-1]) for c in zip(*inner[:-1])]
+    return point_in_ring(centroid, outer)
+
 def relation_to_geojson_feature(rel):
-    multipolygons = []
+    # Les contours d'un grand lac sont souvent découpés en plusieurs chemins :
+    # on les recolle en anneaux extérieurs ("outer") et intérieurs ("inner", les îles)
+    outer_ways, inner_ways = [], []
     for member in rel.get('members', []):
-        if member.get('geometry'):
+        if member.get('type', 'way') == 'way' and member.get('geometry'):
             coords = [[pt['lon'], pt['lat']] for pt in member['geometry']]
-            if coords and coords[0] != coords[-1]:
-                coords.append(coords[0])
-            multipolygons.append([coords])
+            (inner_ways if member.get('role') == 'inner' else outer_ways).append(coords)
+    outers, unassembled_outer = assemble_rings(outer_ways)
+    inners, unassembled_inner = assemble_rings(inner_ways)
+
+    multipolygons = [[outer] for outer in outers]
+    unmatched_inner = 0
+    for inner in inners:
+        for polygon in multipolygons:
+            if inner_in_outer(inner, polygon[0]):
+                polygon.append(inner)
+                break
+        else:
+            unmatched_inner += 1
+
+    if unassembled_outer or unassembled_inner or unmatched_inner:
+        # Les morceaux non fermés (relation incomplète) sont ignorés plutôt que fermés par une corde,
+        # de même que les anneaux intérieurs qui ne tombent dans aucun anneau extérieur
+        print(f"Relation {rel.get('id')} : {unassembled_outer + unassembled_inner} morceau(x) non fermé(s) "
+              f"et {unmatched_inner} anneau(x) intérieur(s) sans contour ignoré(s)")
+    if not outers:
+        return None
     props = {
+        "osm_id": f"relation/{rel.get('id', '')}",
         "name": rel.get('tags', {}).get('name', ''),
         "type": "lac" if "lac" in rel.get('tags', {}).get('name', '').lower() else 
                 "lagune" if "lagune" in rel.get('tags', {}).get('name', '').lower() else
@@ -67,6 +146,28 @@ def relation_to_geojson_feature(rel):
         }
     }
 
+def round_coords(coords, precision=6):
+    # 6 décimales ~ 10 cm, largement suffisant pour l'affichage mobile
+    if coords and isinstance(coords[0], (int, float)):
+        return [round(c, precision) for c in coords]
+    return [round_coords(c, precision) for c in coords]
+
+def write_bundle(features, bundle_path):
+    """Écrit un GeoJSONSeq (RFC 8142) compressé en gzip pour les clients hors-ligne."""
+    with gzip.open(bundle_path, "wt", encoding="utf-8") as f:
+        for feature in features:
+            geometry = feature["geometry"]
+            compact = {
+                **feature,
+                "geometry": {
+                    "type": geometry["type"],
+                    "coordinates": round_coords(geometry["coordinates"])
+                }
+            }
+            f.write("\x1e")
+            f.write(json.dumps(compact, ensure_ascii=False, separators=(",", ":")))
+            f.write("\n")
+
 def main():
     osm_data = fetch_osm_data()
     features = []
@@ -74,7 +175,9 @@ def main():
         if el['type'] == 'way' and el.get('geometry'):
             features.append(way_to_geojson_feature(el))
         elif el['type'] == 'relation' and el.get('members'):
-            features.append(relation_to_geojson_feature(el))
+            feature = relation_to_geojson_feature(el)
+            if feature:
+                features.append(feature)
     geojson = {
         "type": "FeatureCollection",
         "features": features
@@ -84,11 +187,16 @@ def main():
         json.dump(geojson, f, ensure_ascii=False, indent=2)
     print(f"Extraction terminée ! Fichier {output_path} généré avec {len(features)} plans d'eau.")
 
+    bundle_path = "lacs_cotedivoire.geojsonl.gz"
+    write_bundle(features, bundle_path)
+    print(f"Bundle hors-ligne {bundle_path} généré ({os.path.getsize(bundle_path) // 1024} Ko).")
+
     # Copie automatique dans app/src/main/assets/
     assets_path = "app/src/main/assets/"
     os.makedirs(assets_path, exist_ok=True)
     copyfile(output_path, os.path.join(assets_path, output_path))
-    print(f"Fichier copié dans {assets_path}")
+    copyfile(bundle_path, os.path.join(assets_path, bundle_path))
+    print(f"Fichiers copiés dans {assets_path}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+# The backend is run from its own directory (`uvicorn server:app`), so its modules import each other by name
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
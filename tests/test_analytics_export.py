@@ -0,0 +1,111 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+pq = pytest.importorskip("pyarrow.parquet")
+
+import analytics_export
+import server
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient()["test_database"]
+    monkeypatch.setattr(analytics_export, "db", db)
+    return db
+
+
+def report(id, created_at, lake_id="kossou"):
+    return server.Report(
+        id=id, lake_id=lake_id, user_id="u", user_name="n", description="",
+        image_base64="aW1hZ2U=", created_at=created_at
+    ).dict()
+
+
+def exported_ids(output_dir, collection="reports"):
+    return sorted(pq.read_table(output_dir / collection).column("id").to_pylist())
+
+
+def test_export_partitions_and_excludes_media(db, tmp_path):
+    async def scenario():
+        await db.lakes.insert_one(server.Lake(id="kossou", name="Lac de Kossou", latitude=7.0, longitude=-5.5,
+                                              region="Région de Yamoussoukro").dict())
+        await db.reports.insert_many([report("a", datetime(2026, 9, 1)), report("b", datetime(2026, 10, 1), "x")])
+        await db.users.insert_one(server.User(email="e", name="n", session_token="secret").dict())
+        await analytics_export.run_export(tmp_path)
+
+    asyncio.run(scenario())
+
+    table = pq.read_table(tmp_path / "reports")
+    assert "image_base64" not in table.column_names
+    assert "session_token" not in pq.read_table(tmp_path / "users").column_names
+    rows = {row["id"]: row for row in table.to_pylist()}
+    assert (rows["a"]["month"], rows["a"]["region"]) == ("2026-09", "Région de Yamoussoukro")
+    assert (rows["b"]["month"], rows["b"]["region"]) == ("2026-10", analytics_export.UNKNOWN_REGION)
+
+
+def test_incremental_picks_up_late_insert_without_duplicates(db, tmp_path):
+    now = datetime(2026, 10, 19, 12)
+
+    async def scenario():
+        await db.reports.insert_many([report("a", now - timedelta(seconds=10)), report("b", now)])
+        await analytics_export.run_export(tmp_path, incremental=True)
+        # Created before "b" but committed after the first export read it
+        await db.reports.insert_one(report("late", now - timedelta(seconds=5)))
+        await db.reports.insert_one(report("c", now + timedelta(seconds=1)))
+        await analytics_export.run_export(tmp_path, incremental=True)
+
+    asyncio.run(scenario())
+    assert exported_ids(tmp_path) == ["a", "b", "c", "late"]
+
+
+def test_state_is_saved_after_each_batch(db, tmp_path, monkeypatch):
+    now = datetime(2026, 10, 19, 12)
+    write_batch = analytics_export.write_batch
+    calls = []
+
+    def failing_write_batch(*args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise RuntimeError("interrupted")
+        write_batch(*args)
+
+    async def scenario():
+        await db.reports.insert_many([report(str(i), now + timedelta(seconds=i)) for i in range(4)])
+        monkeypatch.setattr(analytics_export, "write_batch", failing_write_batch)
+        with pytest.raises(RuntimeError):
+            await analytics_export.run_export(tmp_path, incremental=True, batch_size=2)
+        monkeypatch.setattr(analytics_export, "write_batch", write_batch)
+        await analytics_export.run_export(tmp_path, incremental=True, batch_size=2)
+
+    asyncio.run(scenario())
+    state = json.loads((tmp_path / analytics_export.STATE_FILE).read_text())
+    assert state["reports"]["last_created_at"] == (now + timedelta(seconds=3)).isoformat()
+    assert exported_ids(tmp_path) == ["0", "1", "2", "3"]
+
+
+def test_full_export_refuses_directory_with_data(db, tmp_path):
+    async def scenario():
+        await db.reports.insert_one(report("a", datetime(2026, 9, 1)))
+        await analytics_export.run_export(tmp_path)
+        with pytest.raises(FileExistsError):
+            await analytics_export.run_export(tmp_path)
+
+    asyncio.run(scenario())
+    assert exported_ids(tmp_path) == ["a"]
+
+
+def test_lakes_are_rewritten_on_every_run(db, tmp_path):
+    async def scenario():
+        await db.lakes.insert_one(server.Lake(id="kossou", name="Lac de Kossou", latitude=7.0, longitude=-5.5).dict())
+        await analytics_export.run_export(tmp_path, incremental=True)
+        await db.lakes.update_one({"id": "kossou"}, {"$set": {"status": "pollué"}})
+        await analytics_export.run_export(tmp_path, incremental=True)
+
+    asyncio.run(scenario())
+    lakes = pq.read_table(tmp_path / "lakes").to_pylist()
+    assert [(lake["id"], lake["status"]) for lake in lakes] == [("kossou", "pollué")]
+    assert [path.name for path in tmp_path.iterdir() if path.name.startswith(".")] == []
@@ -0,0 +1,90 @@
+import pytest
+
+pytest.importorskip("requests")
+
+from scripts_extract_lacs_cotedivoire_Version4 import assemble_rings, relation_to_geojson_feature
+from water_bodies import WaterBodyIndex
+
+
+def member(role, *points):
+    return {"type": "way", "role": role, "geometry": [{"lon": lon, "lat": lat} for lon, lat in points]}
+
+
+def test_split_ways_are_joined_into_one_ring():
+    # One square split into three ways, one of them in the reverse direction
+    rings, unassembled = assemble_rings([
+        [[0, 0], [1, 0]],
+        [[1, 1], [1, 0]],
+        [[1, 1], [0, 1], [0, 0]],
+    ])
+    assert unassembled == 0
+    assert len(rings) == 1
+    ring = rings[0]
+    assert ring[0] == ring[-1] and len(ring) == 5
+    assert sorted(map(tuple, ring[:-1])) == [(0, 0), (0, 1), (1, 0), (1, 1)]
+
+
+def test_open_pieces_are_not_closed_with_a_chord():
+    rings, unassembled = assemble_rings([[[0, 0], [1, 0], [1, 1]]])
+    assert (rings, unassembled) == ([], 1)
+
+
+def test_relation_assembles_outer_and_inner_rings():
+    relation = {
+        "id": 1,
+        "tags": {"name": "Lac de Kossou", "natural": "water"},
+        "members": [
+            member("outer", (0, 0), (2, 0)),
+            member("outer", (2, 0), (2, 2), (0, 2)),
+            member("outer", (0, 2), (0, 0)),
+            member("inner", (0.5, 0.5), (1, 0.5), (1, 1)),
+            member("inner", (1, 1), (0.5, 1), (0.5, 0.5)),
+            member("outer", (5, 5), (6, 5), (6, 6), (5, 6), (5, 5)),
+        ],
+    }
+    feature = relation_to_geojson_feature(relation)
+    assert feature["properties"]["osm_id"] == "relation/1"
+    polygons = feature["geometry"]["coordinates"]
+    assert sorted(len(polygon) for polygon in polygons) == [1, 2]
+
+    index = WaterBodyIndex([feature])
+    # Outside the triangle that closing the middle way on its own would give
+    assert index.locate(0.3, 0.2, max_distance=0) == (0, 0.0)
+    assert index.locate(0.75, 0.75, max_distance=0) is None  # island
+    assert index.locate(5.5, 5.5, max_distance=0) == (0, 0.0)
+
+
+def test_relation_without_closed_outer_ring_is_skipped():
+    relation = {"id": 2, "tags": {}, "members": [member("outer", (0, 0), (1, 0), (1, 1))]}
+    assert relation_to_geojson_feature(relation) is None
+
+
+def test_island_sharing_a_node_with_the_shore_is_assigned_to_its_lake(capsys):
+    # The island starts on the shore node (0, 0); the other lake's ring is listed first
+    # and contains none of the island
+    relation = {
+        "id": 3,
+        "tags": {},
+        "members": [
+            member("outer", (-2, -2), (-1, -2), (-1, -1), (-2, -1), (-2, -2)),
+            member("outer", (0, 0), (2, 0), (2, 2), (0, 2), (0, 0)),
+            member("inner", (0, 0), (1, 0.5), (0.5, 1), (0, 0)),
+        ],
+    }
+    polygons = relation_to_geojson_feature(relation)["geometry"]["coordinates"]
+    assert [len(polygon) for polygon in polygons] == [1, 2]
+    assert capsys.readouterr().out == ""
+
+
+def test_unmatched_inner_ring_is_reported(capsys):
+    relation = {
+        "id": 4,
+        "tags": {},
+        "members": [
+            member("outer", (0, 0), (1, 0), (1, 1), (0, 1), (0, 0)),
+            member("inner", (5, 5), (6, 5), (6, 6), (5, 5)),
+        ],
+    }
+    polygons = relation_to_geojson_feature(relation)["geometry"]["coordinates"]
+    assert [len(polygon) for polygon in polygons] == [1]
+    assert "1 anneau(x) intérieur(s) sans contour ignoré(s)" in capsys.readouterr().out
@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from rate_limit import InMemoryBucketStore, MongoBucketStore, RateLimitMiddleware, RateLimitRule
+
+
+def make_client(rules, store=None, trusted_proxies=0):
+    app = FastAPI()
+
+    @app.post("/api/reports")
+    async def create_report(request: Request):
+        return {"size": len(await request.body())}
+
+    @app.get("/api/reports/lake/{lake_id}")
+    async def get_reports_by_lake(lake_id: str):
+        return {"lake_id": lake_id}
+
+    app.add_middleware(RateLimitMiddleware, rules=rules, store=store or InMemoryBucketStore(),
+                       trusted_proxies=trusted_proxies)
+    return TestClient(app)
+
+
+def chunks(*parts):
+    yield from parts
+
+
+def test_rule_matches_path_parameters():
+    rule = RateLimitRule("GET", "/api/reports/lake/{lake_id}", capacity=1, refill_per_second=1)
+    assert rule.matches("GET", "/api/reports/lake/abc")
+    assert rule.matches("GET", "/api/reports/lake/abc/")
+    assert not rule.matches("POST", "/api/reports/lake/abc")
+    assert not rule.matches("GET", "/api/reports/lake/abc/extra")
+    assert not rule.matches("GET", "/api/reports")
+
+
+def test_exhausted_bucket_returns_429_with_retry_after():
+    client = make_client([RateLimitRule("GET", "/api/reports/lake/{lake_id}", capacity=2, refill_per_second=1 / 30)])
+    assert [client.get(f"/api/reports/lake/{lake}").status_code for lake in ("a", "b")] == [200, 200]
+
+    response = client.get("/api/reports/lake/c")
+    assert response.status_code == 429
+    assert 29 <= int(response.headers["retry-after"]) <= 30
+
+
+def test_session_bucket_is_separate_from_ip_bucket():
+    client = make_client([RateLimitRule("GET", "/api/reports/lake/{lake_id}", capacity=1, refill_per_second=1 / 30)])
+    assert client.get("/api/reports/lake/a", headers={"X-Session-ID": "s1"}).status_code == 200
+    # Same IP, so a fresh session does not get around the IP bucket
+    assert client.get("/api/reports/lake/a", headers={"X-Session-ID": "s2"}).status_code == 429
+
+
+def test_ip_bucket_can_be_looser_than_session_bucket():
+    client = make_client([RateLimitRule("GET", "/api/reports/lake/{lake_id}", capacity=1, refill_per_second=1 / 30,
+                                        ip_capacity=3, ip_refill_per_second=1 / 30)])
+    # Several users behind one NAT address each get their own session limit
+    statuses = [client.get("/api/reports/lake/a", headers={"X-Session-ID": session}).status_code
+                for session in ("s1", "s1", "s2", "s3", "s4")]
+    assert statuses == [200, 429, 200, 429, 429]
+
+
+def test_forwarded_for_uses_entry_appended_by_trusted_proxy():
+    client = make_client([RateLimitRule("GET", "/api/reports/lake/{lake_id}", capacity=1, refill_per_second=1 / 30)],
+                         trusted_proxies=1)
+    # The client controls the left part of the header; the ingress appends the real address
+    assert client.get("/api/reports/lake/a", headers={"X-Forwarded-For": "1.1.1.1, 203.0.113.7"}).status_code == 200
+    assert client.get("/api/reports/lake/a", headers={"X-Forwarded-For": "2.2.2.2, 203.0.113.7"}).status_code == 429
+    assert client.get("/api/reports/lake/a", headers={"X-Forwarded-For": "203.0.113.8"}).status_code == 200
+
+
+def test_forwarded_for_ignored_without_trusted_proxies():
+    client = make_client([RateLimitRule("GET", "/api/reports/lake/{lake_id}", capacity=1, refill_per_second=1 / 30)])
+    assert client.get("/api/reports/lake/a", headers={"X-Forwarded-For": "203.0.113.7"}).status_code == 200
+    assert client.get("/api/reports/lake/a", headers={"X-Forwarded-For": "203.0.113.8"}).status_code == 429
+
+
+def test_body_over_content_length_limit_is_rejected():
+    client = make_client([RateLimitRule("POST", "/api/reports", capacity=10, refill_per_second=1, max_body_bytes=10)])
+    assert client.post("/api/reports", content=b"x" * 11).status_code == 413
+    assert client.post("/api/reports", content=b"x" * 10).json() == {"size": 10}
+
+
+def test_chunked_body_is_capped_and_replayed():
+    client = make_client([RateLimitRule("POST", "/api/reports", capacity=10, refill_per_second=1, max_body_bytes=10)])
+    assert client.post("/api/reports", content=chunks(b"1234567", b"89012")).status_code == 413
+    assert client.post("/api/reports", content=chunks(b"123", b"45")).json() == {"size": 5}
+
+
+def test_eviction_keeps_throttled_buckets():
+    async def scenario():
+        store = InMemoryBucketStore(max_keys=10)
+        assert (await store.take("ip:attacker", 1, 1 / 60))[0]
+        assert not (await store.take("ip:attacker", 1, 1 / 60))[0]
+        for i in range(30):
+            await store.take(f"session:{i}", 5, 1 / 60)
+        assert "ip:attacker" in store.buckets
+        assert not (await store.take("ip:attacker", 1, 1 / 60))[0]
+        assert len(store.buckets) <= 10
+
+    asyncio.run(scenario())
+
+
+def test_mongo_store_shares_buckets_and_hashes_sessions():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    collection = mongomock_motor.AsyncMongoMockClient()["test_database"]["rate_limits"]
+    rules = [RateLimitRule("GET", "/api/reports/lake/{lake_id}", capacity=2, refill_per_second=1 / 30)]
+    store = MongoBucketStore(collection)
+    client = make_client(rules, store)
+    other_worker = make_client(rules, store)
+
+    assert client.get("/api/reports/lake/a", headers={"X-Session-ID": "secret"}).status_code == 200
+    assert other_worker.get("/api/reports/lake/a").status_code == 200
+    response = client.get("/api/reports/lake/a")
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
+
+    async def bucket_ids():
+        return [bucket["_id"] async for bucket in collection.find()]
+
+    ids = asyncio.run(bucket_ids())
+    assert not any("secret" in bucket_id for bucket_id in ids)
+    assert any(hashlib.sha256(b"secret").hexdigest() in bucket_id for bucket_id in ids)
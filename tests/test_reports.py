@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from water_bodies import WaterBodyIndex
+
+USER = server.User(id="u", email="user@example.com", name="User", session_token="session")
+
+LAKE_KOSSOU = {
+    "type": "Feature",
+    "properties": {"osm_id": "relation/1", "name": "Lac de Kossou"},
+    "geometry": {"type": "Polygon", "coordinates": [[[-5.6, 6.9], [-5.4, 6.9], [-5.4, 7.1], [-5.6, 7.1], [-5.6, 6.9]]]},
+}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient()["test_database"]
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "water_bodies", WaterBodyIndex([LAKE_KOSSOU]))
+    asyncio.run(db.lakes.insert_one(server.Lake(
+        id="kossou", name="Lac de Kossou", latitude=7.0, longitude=-5.5, water_body_id="relation/1"
+    ).dict()))
+    return db
+
+
+def create_report(**fields):
+    return asyncio.run(server.create_report(server.ReportCreate(description="d", **fields), current_user=USER))
+
+
+@pytest.mark.parametrize("coordinates", [
+    {"latitude": 500, "longitude": -5.5},
+    {"latitude": 7.0, "longitude": -900},
+    {"latitude": float("nan"), "longitude": -5.5},
+    {"latitude": 7.0, "longitude": float("inf")},
+])
+def test_invalid_coordinates_are_rejected(coordinates):
+    with pytest.raises(ValidationError):
+        server.ReportCreate(lake_id="kossou", description="d", **coordinates)
+
+
+def test_invalid_coordinates_are_rejected_over_http(db):
+    server.rate_limit_store.buckets.clear()
+    asyncio.run(db.users.insert_one(USER.dict()))
+    client = TestClient(server.app)
+    for body in ('{"lake_id": "kossou", "description": "d", "latitude": 500, "longitude": -900}',
+                 '{"lake_id": "kossou", "description": "d", "latitude": NaN, "longitude": -5.5}'):
+        response = client.post("/api/reports", content=body,
+                               headers={"X-Session-ID": "session", "Content-Type": "application/json"})
+        assert response.status_code == 422
+    assert asyncio.run(db.reports.count_documents({})) == 0
+
+
+def test_only_one_coordinate_is_rejected(db):
+    with pytest.raises(HTTPException) as error:
+        create_report(lake_id="kossou", latitude=7.0)
+    assert error.value.status_code == 400
+
+
+def test_coordinates_override_client_lake(db):
+    report = create_report(lake_id="somewhere-else", latitude=7.0, longitude=-5.5)
+    assert (report.lake_id, report.water_body_id) == ("kossou", "relation/1")
+
+
+def test_client_lake_kept_when_coordinates_match_nothing(db):
+    report = create_report(lake_id="somewhere-else", latitude=9.0, longitude=-3.0)
+    assert (report.lake_id, report.water_body_id) == ("somewhere-else", None)
+
+
+def test_no_lake_resolved_and_none_given_is_rejected(db):
+    with pytest.raises(HTTPException) as error:
+        create_report(latitude=9.0, longitude=-3.0)
+    assert error.value.status_code == 400
+    assert asyncio.run(db.reports.count_documents({})) == 0
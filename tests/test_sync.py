@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient()["test_database"]
+    monkeypatch.setattr(server, "db", db)
+    return db
+
+
+ADMIN = server.User(email="admin@example.com", name="Admin", session_token="admin", is_admin=True)
+
+
+def test_sync_returns_changes_and_tombstones(db):
+    async def scenario():
+        lake = server.Lake(name="Lac de Kossou", latitude=7.0, longitude=-5.5)
+        await db.lakes.insert_one(lake.dict())
+        post = await server.create_awareness_post(server.AwarenessPostCreate(title="t", content="c"), current_user=ADMIN)
+
+        first = await server.sync(since=0)
+        assert [p.id for p in first.awareness_posts] == [post.id]
+        assert first.version == post.version
+
+        await server.update_lake_status(lake.id, "pollué", current_user=ADMIN)
+        await server.delete_awareness_post(post.id, current_user=ADMIN)
+
+        second = await server.sync(since=first.version)
+        assert [(l.id, l.status) for l in second.lakes] == [(lake.id, "pollué")]
+        assert second.awareness_posts == []
+        assert [(t.collection, t.id) for t in second.tombstones] == [("awareness_posts", post.id)]
+
+        assert (await server.sync(since=second.version)).lakes == []
+
+    asyncio.run(scenario())
+
+
+def test_sync_does_not_skip_write_in_flight(db, monkeypatch):
+    # A sync that runs between a writer taking its version and storing it
+    # must not move the client past that version
+    async def scenario():
+        lake = server.Lake(name="Lac de Kossou", latitude=7.0, longitude=-5.5, version=1)
+        await db.lakes.insert_one(lake.dict())
+        async with server.sync_version():
+            pass
+
+        version_taken = asyncio.Event()
+        resume_write = asyncio.Event()
+        take_sync_version = server.take_sync_version
+
+        async def slow_take_sync_version():
+            version = await take_sync_version()
+            version_taken.set()
+            await resume_write.wait()
+            return version
+
+        monkeypatch.setattr(server, "take_sync_version", slow_take_sync_version)
+        write = asyncio.create_task(server.update_lake_status(lake.id, "pollué", current_user=ADMIN))
+        await version_taken.wait()
+
+        during = await server.sync(since=0)
+        assert during.version == 1
+
+        resume_write.set()
+        await write
+
+        after = await server.sync(since=during.version)
+        assert [(l.id, l.status) for l in after.lakes] == [(lake.id, "pollué")]
+        assert after.version == 2
+
+    asyncio.run(scenario())
+
+
+def test_stale_pending_version_stops_holding_back_sync(db, monkeypatch):
+    async def scenario():
+        await server.take_sync_version()  # never released, as if the writer crashed
+        assert await server.committed_sync_version() == 0
+
+        monkeypatch.setattr(server, "SYNC_PENDING_TIMEOUT", server.timedelta(seconds=-1))
+        assert await server.committed_sync_version() == 1
+
+    asyncio.run(scenario())
+
+
+def test_tombstone_is_written_before_the_post_is_deleted(db, monkeypatch):
+    async def scenario():
+        post = await server.create_awareness_post(server.AwarenessPostCreate(title="t", content="c"), current_user=ADMIN)
+        before = await server.sync(since=0)
+
+        async def failing_delete_one(*args, **kwargs):
+            raise RuntimeError("connection lost")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(type(db.awareness_posts), "delete_one", failing_delete_one)
+            with pytest.raises(RuntimeError):
+                await server.delete_awareness_post(post.id, current_user=ADMIN)
+
+        after = await server.sync(since=before.version)
+        assert [t.id for t in after.tombstones] == [post.id]
+
+        with pytest.raises(server.HTTPException) as error:
+            await server.delete_awareness_post("missing", current_user=ADMIN)
+        assert error.value.status_code == 404
+        assert (await server.sync(since=after.version)).tombstones == []
+
+    asyncio.run(scenario())
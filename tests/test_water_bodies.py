@@ -0,0 +1,85 @@
+import random
+
+import numpy as np
+import pytest
+
+from water_bodies import METERS_PER_DEGREE, WaterBodyIndex
+
+
+def square(min_x, min_y, size, osm_id=None):
+    ring = [[min_x, min_y], [min_x + size, min_y], [min_x + size, min_y + size], [min_x, min_y + size], [min_x, min_y]]
+    return {"properties": {"osm_id": osm_id}, "geometry": {"type": "Polygon", "coordinates": [ring]}}
+
+
+def random_index(count=3000, seed=1):
+    rng = random.Random(seed)
+    features = [
+        square(rng.uniform(-8, -3), rng.uniform(4.5, 10), rng.uniform(0.001, 0.05), f"way/{i}")
+        for i in range(count)
+    ]
+    return WaterBodyIndex(features), rng
+
+
+def test_candidates_match_brute_force_bounding_boxes():
+    index, rng = random_index()
+    assert len(index.levels) > 2
+    for _ in range(500):
+        min_x, min_y = rng.uniform(-8.1, -3), rng.uniform(4.4, 10)
+        max_x, max_y = min_x + rng.uniform(0, 0.2), min_y + rng.uniform(0, 0.2)
+        expected = np.flatnonzero(
+            (index.bounds[:, 0] <= max_x) & (index.bounds[:, 2] >= min_x)
+            & (index.bounds[:, 1] <= max_y) & (index.bounds[:, 3] >= min_y)
+        )
+        assert sorted(index.candidates(min_x, min_y, max_x, max_y)) == list(expected)
+
+
+def test_locate_matches_brute_force_containment():
+    index, rng = random_index()
+    for _ in range(500):
+        lon, lat = rng.uniform(-8, -3), rng.uniform(4.5, 10)
+        in_box = np.flatnonzero(
+            (index.bounds[:, 0] <= lon) & (index.bounds[:, 2] >= lon)
+            & (index.bounds[:, 1] <= lat) & (index.bounds[:, 3] >= lat)
+        )
+        containing = [f for f in in_box if index.contains(f, lon, lat)]
+        located = index.locate(lon, lat, max_distance=0)
+        if containing:
+            assert located is not None and located[0] in containing and located[1] == 0
+        else:
+            assert located is None
+
+
+def test_point_inside_hole_is_outside():
+    outer = [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]
+    hole = [[0.4, 0.4], [0.6, 0.4], [0.6, 0.6], [0.4, 0.6], [0.4, 0.4]]
+    index = WaterBodyIndex([{"properties": {"osm_id": "relation/1"},
+                             "geometry": {"type": "Polygon", "coordinates": [outer, hole]}}])
+    assert index.locate(0.2, 0.2) == (0, 0.0)
+    assert index.locate(0.5, 0.5, max_distance=0) is None
+    # 0.1 degrees from the hole's edge
+    feature, distance = index.locate(0.5, 0.5, max_distance=20000)
+    assert feature == 0 and distance == pytest.approx(0.1 * METERS_PER_DEGREE, rel=1e-3)
+
+
+def test_nearest_polygon_within_max_distance():
+    index = WaterBodyIndex([square(0, 0, 0.1, "way/near"), square(0.2, 0, 0.1, "way/far")])
+    # 0.01 degrees (about 1.1 km) east of the first square, 0.09 west of the second
+    feature, distance = index.locate(0.11, 0.05, max_distance=2000)
+    assert index.ids[feature] == "way/near"
+    assert distance == pytest.approx(0.01 * METERS_PER_DEGREE * np.cos(np.radians(0.05)), rel=1e-3)
+    assert index.locate(0.11, 0.05, max_distance=1000) is None
+
+
+def test_feature_ids_fall_back_to_position_and_skip_empty_geometries():
+    index = WaterBodyIndex([
+        {"properties": {}, "geometry": {"type": "MultiPolygon", "coordinates": []}},
+        {"properties": {}, "geometry": square(0, 0, 1)["geometry"]},
+    ])
+    assert index.ids == ["feature/1"]
+
+
+def test_empty_index():
+    index = WaterBodyIndex([])
+    assert len(index) == 0
+    assert index.locate(-5.5, 7.0) is None
+    assert list(index.candidates(-180, -90, 180, 90)) == []